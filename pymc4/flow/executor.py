@@ -1,5 +1,5 @@
 import types
-from typing import Any, Tuple, Dict, Union, List, Optional, Set, Mapping
+from typing import Any, Tuple, Dict, Union, List, Optional, Set, Mapping, Iterable
 from collections import ChainMap
 import itertools
 
@@ -216,15 +216,24 @@ class SamplingState:
     ) -> "SamplingState":
         if values is None:
             return cls(observed_values=observed_values)
+        return cls.from_positional(values.keys(), values.values(), observed_values=observed_values)
+
+    @classmethod
+    def from_positional(
+        cls,
+        keys: Iterable[str],
+        values: Iterable[Any],
+        observed_values: Dict[str, Any] = None,
+    ) -> "SamplingState":
         transformed_values = dict()
         untransformed_values = dict()
         # split by `nest/name` or `nest/__transform_name`
-        for fullname in values:
+        for fullname, value in zip(keys, values):
             namespec = utils.NameParts.from_name(fullname)
             if namespec.is_transformed:
-                transformed_values[fullname] = values[fullname]
+                transformed_values[fullname] = value
             else:
-                untransformed_values[fullname] = values[fullname]
+                untransformed_values[fullname] = value
         return cls(transformed_values, untransformed_values, observed_values)
 
     def clone(self) -> "SamplingState":
@@ -1,11 +1,21 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Sequence
 import tensorflow as tf
 from tensorflow_probability import mcmc
+from tensorflow_probability.python.internal import vectorization_util
 from pymc4.coroutine_model import Model
 from pymc4 import flow
 from pymc4.inference.utils import initialize_sampling_state, trace_to_arviz
 from pymc4.utils import NameParts
 
+# Keep in sync with pymc3 naming convention
+NUTS_STATS = {
+    "lp": lambda pkr: pkr.inner_results.target_log_prob,
+    "tree_size": lambda pkr: pkr.inner_results.leapfrogs_taken,
+    "diverging": lambda pkr: pkr.inner_results.has_divergence,
+    "energy": lambda pkr: pkr.inner_results.energy,
+    "mean_tree_accept": lambda pkr: pkr.inner_results.log_accept_ratio,
+}
+
 
 def sample(
     model: Model,
@@ -20,6 +30,8 @@ def sample(
     sample_chain_kwargs: Optional[Dict[str, Any]] = None,
     xla: bool = False,
     use_auto_batching: bool = True,
+    trace_stats: Optional[Sequence[str]] = None,
+    trace_deterministics: bool = True,
 ):
     """
     Perform MCMC sampling using NUTS (for now).
@@ -50,19 +62,26 @@ def sample(
         Pass non-default values for nuts kernel, see
         ``tensorflow_probability.mcmc.sample_chain`` for options
     xla : bool
-        Enable experimental XLA
+        Compile the whole sampling loop with XLA (``tf.function(jit_compile=True)``)
     use_auto_batching : bool
         WARNING: This is an advanced user feature. If you are not sure how to use this, please use
         the default ``True`` value.
         If ``True``, the model's total ``log_prob`` will be automatically vectorized to work across
-        multiple independent chains using ``tf.vectorized_map``. If ``False``, the model is assumed
-        be defined in vectorized way. This means that every distribution has the proper
-        ``batch_shape`` and ``event_shape``s so that all the outputs from each distribution's
-        ``log_prob`` will broadcast with each other, and that the forward passes through the model
-        (prior and posterior predictive sampling) all work on values with any value of
-        ``batch_shape``. Achieving this is a hard task, but it enables the model to be safely
-        evaluated in parallel across all chains in MCMC, so sampling will be faster than in the
-        automatically batched scenario.
+        multiple independent chains using
+        ``tensorflow_probability.python.internal.vectorization_util.make_rank_polymorphic``.
+        If ``False``, the model is assumed be defined in vectorized way. This means that every
+        distribution has the proper ``batch_shape`` and ``event_shape``s so that all the outputs
+        from each distribution's ``log_prob`` will broadcast with each other, and that the forward
+        passes through the model (prior and posterior predictive sampling) all work on values with
+        any value of ``batch_shape``. Achieving this is a hard task, but it enables the model to be
+        safely evaluated in parallel across all chains in MCMC, so sampling will be faster than in
+        the automatically batched scenario.
+    trace_stats : Optional[Sequence[str]]
+        Names of the sampler statistics to keep in the trace, a subset of ``NUTS_STATS``. All of
+        them are traced by default, pass an empty sequence to trace none
+    trace_deterministics : bool
+        If ``False``, deterministics and the untransformed values of transformed variables are not
+        computed on every step and are left out of the posterior
 
     Returns
     -------
@@ -106,6 +125,17 @@ def sample(
     This will give a trace with new observed variables. This way is considered to be explicit.
 
     """
+    if trace_stats is None:
+        trace_stats = list(NUTS_STATS)
+    else:
+        trace_stats = list(trace_stats)
+        unknown_stats = set(trace_stats) - set(NUTS_STATS)
+        if unknown_stats:
+            raise ValueError(
+                "Unknown sampler stats {}, available stats are {}".format(
+                    sorted(unknown_stats), list(NUTS_STATS)
+                )
+            )
     (
         logpfn,
         init,
@@ -119,11 +149,13 @@ def sample(
         observed=observed,
         collect_reduced_log_prob=use_auto_batching,
     )
+    trace_deterministics = trace_deterministics and bool(deterministic_names)
     init_state = list(init.values())
     init_keys = list(init.keys())
     if use_auto_batching:
-        parallel_logpfn = vectorize_logp_function(logpfn)
-        deterministics_callback = vectorize_logp_function(_deterministics_callback)
+        core_ndims = [tens.ndim for tens in init_state]
+        parallel_logpfn = vectorize_logp_function(logpfn, core_ndims)
+        deterministics_callback = vectorize_logp_function(_deterministics_callback, core_ndims)
         init_state = tile_init(init_state, num_chains)
     else:
         parallel_logpfn = logpfn
@@ -131,15 +163,13 @@ def sample(
         init_state = tile_init(init_state, num_chains)
 
     def trace_fn(current_state, pkr):
-        return (
-            pkr.inner_results.target_log_prob,
-            pkr.inner_results.leapfrogs_taken,
-            pkr.inner_results.has_divergence,
-            pkr.inner_results.energy,
-            pkr.inner_results.log_accept_ratio,
-        ) + tuple(deterministics_callback(*current_state))
-
-    @tf.function(autograph=False)
+        stats = tuple(NUTS_STATS[name](pkr) for name in trace_stats)
+        if not trace_deterministics:
+            # Don't evaluate the model once more per step just to get nothing back
+            return stats
+        return stats + tuple(deterministics_callback(*current_state))
+
+    @tf.function(autograph=False, jit_compile=xla)
     def run_chains(init, step_size):
         nuts_kernel = mcmc.NoUTurnSampler(
             target_log_prob_fn=parallel_logpfn, step_size=step_size, **(nuts_kwargs or dict())
@@ -164,24 +194,14 @@ def sample(
 
         return results, sample_stats
 
-    if xla:
-        results, sample_stats = tf.xla.experimental.compile(
-            run_chains, inputs=[init_state, step_size]
-        )
-    else:
-        results, sample_stats = run_chains(init_state, step_size)
+    results, sample_stats = run_chains(init_state, step_size)
 
     posterior = dict(zip(init_keys, results))
-    # Keep in sync with pymc3 naming convention
-    stat_names = ["lp", "tree_size", "diverging", "energy", "mean_tree_accept"]
-    if len(sample_stats) > len(stat_names):
-        deterministic_values = sample_stats[len(stat_names) :]
-        sample_stats = sample_stats[: len(stat_names)]
-    sampler_stats = dict(zip(stat_names, sample_stats))
-    if len(deterministic_names) > 0:
-        posterior.update(dict(zip(deterministic_names, deterministic_values)))
+    sampler_stats = dict(zip(trace_stats, sample_stats[: len(trace_stats)]))
+    if trace_deterministics:
+        posterior.update(dict(zip(deterministic_names, sample_stats[len(trace_stats) :])))
 
-    return trace_to_arviz(posterior, sampler_stats, observed_data=state_.observed_values)
+    return trace_to_arviz(posterior, sampler_stats or None, observed_data=state_.observed_values)
 
 
 def build_logp_and_deterministic_functions(
@@ -210,20 +230,32 @@ def build_logp_and_deterministic_functions(
     observed_var = state.observed_values
     unobserved_keys, unobserved_values = zip(*state.all_unobserved_values.items())
 
+    if collect_reduced_log_prob:
+        # Auto batching evaluates the model one chain at a time
+        batch_shape = tf.TensorShape([])
+    elif num_chains is not None:
+        batch_shape = tf.TensorShape([num_chains])
+    else:
+        # A vectorized model may be called with any batch shape, including none
+        batch_shape = tf.TensorShape(None)
+    # Pin a single signature so the model is traced once and never retraced
+    input_signature = [
+        tf.TensorSpec(batch_shape.concatenate(value.shape), value.dtype)
+        for value in unobserved_values
+    ]
+
     if collect_reduced_log_prob:
 
-        @tf.function(autograph=False)
-        def logpfn(*values, **kwargs):
-            if kwargs and values:
-                raise TypeError("Either list state should be passed or a dict one")
-            elif values:
-                kwargs = dict(zip(unobserved_keys, values))
-            st = flow.SamplingState.from_values(kwargs, observed_values=observed)
+        @tf.function(autograph=False, input_signature=input_signature)
+        def logpfn(*values):
+            st = flow.SamplingState.from_positional(
+                unobserved_keys, values, observed_values=observed
+            )
             _, st = flow.evaluate_model_transformed(model, state=st)
             return st.collect_log_prob()
 
     else:
-        # When we use manual batching, we need to manually tile the chains axis
+        # When we use manual batching, we need to manually broadcast the chains axis
         # to the left of the observed tensors
         if num_chains is not None:
             obs = state.observed_values
@@ -233,48 +265,55 @@ def build_logp_and_deterministic_functions(
                 observed = obs
             for k, o in obs.items():
                 o = tf.convert_to_tensor(o)
-                o = tf.tile(o[None, ...], [num_chains] + [1] * o.ndim)
-                observed[k] = o
-
-        @tf.function(autograph=False)
-        def logpfn(*values, **kwargs):
-            if kwargs and values:
-                raise TypeError("Either list state should be passed or a dict one")
-            elif values:
-                kwargs = dict(zip(unobserved_keys, values))
-            st = flow.SamplingState.from_values(kwargs, observed_values=observed)
+                observed[k] = tf.broadcast_to(o[None, ...], [num_chains] + o.shape.as_list())
+
+        @tf.function(autograph=False, input_signature=input_signature)
+        def logpfn(*values):
+            st = flow.SamplingState.from_positional(
+                unobserved_keys, values, observed_values=observed
+            )
             _, st = flow.evaluate_model_transformed(model, state=st)
             return st.collect_unreduced_log_prob()
 
-    @tf.function(autograph=False)
-    def deterministics_callback(*values, **kwargs):
-        if kwargs and values:
-            raise TypeError("Either list state should be passed or a dict one")
-        elif values:
-            kwargs = dict(zip(unobserved_keys, values))
-        st = flow.SamplingState.from_values(kwargs, observed_values=observed_var)
+    @tf.function(autograph=False, input_signature=input_signature)
+    def deterministics_callback(*values):
+        st = flow.SamplingState.from_positional(
+            unobserved_keys, values, observed_values=observed_var
+        )
         _, st = flow.evaluate_model_transformed(model, state=st)
         for transformed_name in st.transformed_values:
             untransformed_name = NameParts.from_name(transformed_name).full_untransformed_name
             st.deterministics[untransformed_name] = st.untransformed_values.pop(untransformed_name)
-        return st.deterministics.values()
+        return list(st.deterministics.values())
 
     return (
-        logpfn,
+        _allow_dict_values(logpfn, unobserved_keys),
         dict(state.all_unobserved_values),
-        deterministics_callback,
+        _allow_dict_values(deterministics_callback, unobserved_keys),
         deterministic_names,
         state,
     )
 
 
-def vectorize_logp_function(logpfn):
-    # TODO: vectorize with dict
-    def vectorized_logpfn(*state):
-        return tf.vectorized_map(lambda mini_state: logpfn(*mini_state), state)
+def _allow_dict_values(fn, keys):
+    # The traced functions only take positional values, keep the dict call available
+    def wrapped(*values, **kwargs):
+        if kwargs and values:
+            raise TypeError("Either list state should be passed or a dict one")
+        elif kwargs:
+            values = [kwargs[key] for key in keys]
+        return fn(*values)
+
+    return wrapped
 
-    return vectorized_logpfn
+
+def vectorize_logp_function(logpfn, core_ndims):
+    # TODO: vectorize with dict
+    # ``make_rank_polymorphic`` lets ``logpfn`` accept any number of leading batch
+    # dimensions on top of the per-value ``core_ndims``, so the chains axis (and any
+    # extra batch axes) are handled in a single call
+    return vectorization_util.make_rank_polymorphic(logpfn, core_ndims=core_ndims)
 
 
 def tile_init(init, num_repeats):
-    return [tf.tile(tf.expand_dims(tens, 0), [num_repeats] + [1] * tens.ndim) for tens in init]
+    return [tf.broadcast_to(tens[None, ...], [num_repeats] + list(tens.shape)) for tens in init]
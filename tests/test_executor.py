@@ -446,6 +446,19 @@ def test_sampling_state_clone(deterministics_in_nested_models):
     assert state.posterior_predictives == clone.posterior_predictives
 
 
+def test_sampling_state_from_positional():
+    keys = ["model/x", "model/__log_y"]
+    values = [0.0, 1.0]
+    observed = {"model/z": 2.0}
+    st = pm.flow.executor.SamplingState.from_positional(keys, values, observed_values=observed)
+    expected = pm.flow.executor.SamplingState.from_values(
+        dict(zip(keys, values)), observed_values=observed
+    )
+    assert st.untransformed_values == expected.untransformed_values == {"model/x": 0.0}
+    assert st.transformed_values == expected.transformed_values == {"model/__log_y": 1.0}
+    assert st.observed_values == expected.observed_values == observed
+
+
 def test_as_sampling_state_failure_on_empty():
     st = pm.flow.executor.SamplingState()
     with pytest.raises(TypeError):
@@ -15,6 +15,26 @@ def test_sample_deterministics(simple_model_with_deterministic, xla_fixture):
     np.testing.assert_allclose(trace.posterior[determ], trace.posterior[norm] * 2)
 
 
+def test_sample_trace_stats_and_deterministics(simple_model_with_deterministic):
+    model = simple_model_with_deterministic()
+    trace = pm.sample(
+        model=model,
+        num_samples=10,
+        num_chains=4,
+        burn_in=10,
+        trace_stats=["lp", "diverging"],
+        trace_deterministics=False,
+    )
+    assert set(trace.sample_stats.data_vars) == {"lp", "diverging"}
+    assert "simple_model_with_deterministic/determ" not in trace.posterior
+
+
+def test_sample_unknown_trace_stats(simple_model_with_deterministic):
+    model = simple_model_with_deterministic()
+    with pytest.raises(ValueError):
+        pm.sample(model=model, num_samples=1, num_chains=1, burn_in=1, trace_stats=["bla"])
+
+
 def test_vectorize_log_prob_det_function(unvectorized_model):
     model, norm_shape, observed, batch_size = unvectorized_model
     model = model()
@@ -25,11 +45,11 @@ def test_vectorize_log_prob_det_function(unvectorized_model):
         deterministic_names,
         state,
     ) = pm.inference.sampling.build_logp_and_deterministic_functions(model)
-    for _ in range(len(batch_size)):
-        logpfn = pm.inference.sampling.vectorize_logp_function(logpfn)
-        deterministics_callback = pm.inference.sampling.vectorize_logp_function(
-            deterministics_callback
-        )
+    core_ndims = [len(norm_shape)]
+    logpfn = pm.inference.sampling.vectorize_logp_function(logpfn, core_ndims)
+    deterministics_callback = pm.inference.sampling.vectorize_logp_function(
+        deterministics_callback, core_ndims
+    )
 
     # Test function inputs and initial values are as expected
     assert set(all_unobserved_values) <= {"unvectorized_model/norm"}
@@ -58,6 +78,33 @@ def test_vectorize_log_prob_det_function(unvectorized_model):
     np.testing.assert_allclose(logpfn_output, expected_log_prob, rtol=1e-5)
 
 
+def test_logp_function_is_traced_once():
+    num_traces = 0
+
+    @pm.model
+    def model():
+        nonlocal num_traces
+        num_traces += 1
+        yield pm.Normal("x", 0, 1)
+
+    logpfn, *_ = pm.inference.sampling.build_logp_and_deterministic_functions(model())
+    logpfn(tf.constant(0.0))
+    num_traces_after_first_call = num_traces
+    logpfn(tf.constant(1.0))
+    logpfn(**{"model/x": tf.constant(2.0)})
+    assert num_traces == num_traces_after_first_call
+
+
+def test_logp_function_mixed_call_fails():
+    @pm.model
+    def model():
+        yield pm.Normal("x", 0, 1)
+
+    logpfn, *_ = pm.inference.sampling.build_logp_and_deterministic_functions(model())
+    with pytest.raises(TypeError):
+        logpfn(tf.constant(0.0), **{"model/x": tf.constant(0.0)})
+
+
 def test_sampling_with_deterministics_in_nested_models(
     deterministics_in_nested_models, xla_fixture
 ):